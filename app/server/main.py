@@ -1,6 +1,11 @@
+import asyncio
 import base64
 import os
 import sys
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -10,19 +15,22 @@ load_dotenv(Path(__file__).resolve().parent / ".env")
 import cv2
 import numpy as np
 import torch
-from fastapi import FastAPI, File, HTTPException, UploadFile
-from openai import OpenAI
+import torch.nn.functional as F
+from fastapi import FastAPI, File, HTTPException, Response, UploadFile
+from openai import AsyncOpenAI
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, confloat
+from torchvision.io import ImageReadMode, decode_image
 
-from .routing import route_order, total_distance_km
+from .onnx_model import OnnxSegmentationModel
+from .routing import route_order, total_distance_km, warm_up as warm_up_routing
 
 ROOT = Path(__file__).resolve().parent.parent.parent
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from model.dataset import get_segmentation_eval_transforms
-from mask import damage_colored_mask, damage_counts
+from mask import damage_colored_mask
 from model.model import DamageSegmentationModel
 
 app = FastAPI(
@@ -38,14 +46,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class _SkipImageGZipMiddleware(GZipMiddleware):
+    """Gzip JSON responses but pass through routes that already return deflated PNG."""
+
+    _UNCOMPRESSED_PATHS = frozenset({"/predict/mask"})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self._UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Base64 JSON payloads (/predict, /seed/*) shrink noticeably even at the cheapest deflate level;
+# /predict/mask is raw PNG, which deflate can't shrink further, so it bypasses compression.
+app.add_middleware(_SkipImageGZipMiddleware, minimum_size=1024, compresslevel=1)
+
 _model = None
 _device = None
 _size = 256
 _num_classes = 5
+_CLASS_NAMES = ["background", "no_damage", "minor_damage", "major_damage", "destroyed"]
+# All model calls run on this one thread: GPU work is serialized and compiled CUDA graphs stay on the
+# thread that recorded them, while decode/encode for other requests proceeds in the default pool.
+_inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+# Concurrent /predict requests are grouped into one forward pass of up to _MAX_BATCH pairs.
+_MAX_BATCH = 8
+_BATCH_WAIT_S = 0.01
+# Batch sizes the compiled model is warmed up for; other sizes are padded up to the next one.
+_BATCH_BUCKETS = (1, 2, 4, 8)
+_padded_batches = False
+_batch_queue: asyncio.Queue | None = None
+_batch_task: asyncio.Task | None = None
+
+
+def _read_checkpoint(checkpoint_path: Path) -> dict:
+    # mmap: tensors stay on disk until touched, so reading only the metadata is cheap.
+    return torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
 
 
 def _load_model(checkpoint_path: Path, device: torch.device):
-    ckpt = torch.load(checkpoint_path, map_location=device)
+    ckpt = _read_checkpoint(checkpoint_path)
     encoder = ckpt.get("encoder", "resnet34")
     size = ckpt.get("size", 256)
     num_classes = ckpt.get("num_classes", 5)
@@ -54,11 +97,13 @@ def _load_model(checkpoint_path: Path, device: torch.device):
         encoder_weights=None,
         in_channels=6,
         num_classes=num_classes,
+        normalize_input=True,
     )
+    # assign: mmap'd tensors are adopted by the module without a second copy.
     if isinstance(ckpt, dict) and "model_state_dict" in ckpt:
-        model.load_state_dict(ckpt["model_state_dict"])
+        model.load_state_dict(ckpt["model_state_dict"], assign=True)
     else:
-        model.load_state_dict(ckpt)
+        model.load_state_dict(ckpt, assign=True)
     model.to(device)
     model.eval()
     return model, size, num_classes
@@ -67,6 +112,7 @@ def _load_model(checkpoint_path: Path, device: torch.device):
 @app.on_event("startup")
 def startup():
     global _model, _device, _size, _num_classes
+    warm_up_routing()
     checkpoint = ROOT / "checkpoints" / "best.pt"
     if not checkpoint.exists():
         raise FileNotFoundError(
@@ -78,34 +124,142 @@ def startup():
         else "mps" if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available()
         else "cpu"
     )
+    onnx_path = os.environ.get("ONNX_MODEL_PATH")
+    if onnx_path:
+        # Only size/num_classes come from the checkpoint; no PyTorch model is built or moved to the device.
+        ckpt = _read_checkpoint(checkpoint)
+        _size = ckpt.get("size", 256)
+        _num_classes = ckpt.get("num_classes", 5)
+        if _device.type not in ("cuda", "cpu"):
+            warnings.warn(f"ONNX Runtime can't run on {_device.type}; serving ONNX_MODEL_PATH on cpu")
+            _device = torch.device("cpu")
+        _model = OnnxSegmentationModel(Path(onnx_path), _device, _num_classes)
+        return
     _model, _size, _num_classes = _load_model(checkpoint, _device)
+    if _device.type == "cuda":
+        _model = _model.to(memory_format=torch.channels_last)
+        _model = _inference_executor.submit(_compile_model, _model).result()
 
 
-def _decode_image(data: bytes) -> np.ndarray:
+def _compile_model(model: torch.nn.Module) -> torch.nn.Module:
+    """torch.compile for fixed inference shapes, warmed up per batch bucket so requests skip compilation."""
+    global _model, _padded_batches
+    eager = model
+    try:
+        _model = torch.compile(model, mode="reduce-overhead", fullgraph=True, dynamic=False)
+        for batch in _BATCH_BUCKETS:
+            dummy = torch.zeros(batch, 3, _size, _size, device=_device)
+            _run_inference(dummy, dummy)
+        _padded_batches = True
+    except Exception as e:
+        warnings.warn(f"torch.compile failed, serving eager model: {e}")
+        _model = eager
+    return _model
+
+
+@app.on_event("startup")
+async def start_batch_worker():
+    global _batch_queue, _batch_task
+    _batch_queue = asyncio.Queue()
+    _batch_task = asyncio.create_task(_batch_worker())
+
+
+def _decode_image(data: bytes) -> torch.Tensor:
+    """Decode straight to a (3, H, W) uint8 RGB tensor; cv2 handles formats torchvision can't."""
+    try:
+        # decode_image never writes its input, so view the upload bytes directly instead of copying them.
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message=".*not writable.*")
+            raw = torch.frombuffer(data, dtype=torch.uint8)
+        # Honour EXIF Orientation like cv2.IMREAD_COLOR does, so pre/post pairs stay aligned.
+        img = decode_image(raw, mode=ImageReadMode.RGB, apply_exif_orientation=True)
+        if img.dtype == torch.uint8:
+            return img
+    except (RuntimeError, ValueError):
+        pass
     arr = np.frombuffer(data, dtype=np.uint8)
     img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
     if img is None:
         raise HTTPException(status_code=400, detail="Invalid image data")
-    return img
+    return torch.from_numpy(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).permute(2, 0, 1)
+
 
+def _upload_resized(batch: torch.Tensor) -> torch.Tensor:
+    # Ship uint8 and resize before scaling, so the /255 pass runs at model size rather than upload size.
+    # (Bilinear interpolate has no uint8 CUDA kernel, hence the float cast first.)
+    t = batch.to(_device, non_blocking=True).float()
+    if t.shape[-2:] != (_size, _size):
+        t = F.interpolate(t, size=(_size, _size), mode="bilinear", align_corners=False)
+    return t.div_(255)
 
-def _preprocess_pair(pre_img: np.ndarray, post_img: np.ndarray) -> tuple[torch.Tensor, torch.Tensor]:
-    pre_rgb = cv2.cvtColor(pre_img, cv2.COLOR_BGR2RGB)
-    post_rgb = cv2.cvtColor(post_img, cv2.COLOR_BGR2RGB)
-    transform = get_segmentation_eval_transforms(_size)
-    transformed = transform(image=pre_rgb, post=post_rgb)
-    pre_t = torch.from_numpy(transformed["image"].transpose(2, 0, 1)).float().unsqueeze(0)
-    post_t = torch.from_numpy(transformed["post"].transpose(2, 0, 1)).float().unsqueeze(0)
-    return pre_t, post_t
 
+def _preprocess_pair(pre_img: torch.Tensor, post_img: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    """Upload the RGB pair and resize on-device; normalization happens in the model."""
+    if pre_img.shape == post_img.shape:
+        t = _upload_resized(torch.stack([pre_img, post_img]))
+        return t[:1], t[1:]
+    return _upload_resized(pre_img[None]), _upload_resized(post_img[None])
 
-def _run_inference(pre_t: torch.Tensor, post_t: torch.Tensor) -> np.ndarray:
-    pre_t = pre_t.to(_device)
-    post_t = post_t.to(_device)
-    with torch.no_grad():
+
+def _run_inference(pre_t: torch.Tensor, post_t: torch.Tensor) -> tuple[np.ndarray, list[list[int]]]:
+    """Forward a (B, 3, H, W) pair batch; return (B, H, W) uint8 class maps and per-sample class histograms."""
+    torch_cuda = _device.type == "cuda" and isinstance(_model, torch.nn.Module)
+    if torch_cuda:
+        pre_t = pre_t.contiguous(memory_format=torch.channels_last)
+        post_t = post_t.contiguous(memory_format=torch.channels_last)
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=torch_cuda):
         logits = _model(pre_t, post_t)
-        pred = logits.argmax(dim=1).squeeze(0).cpu().numpy().astype(np.uint8)
-    return pred
+        pred = logits.argmax(dim=1)
+        # One bincount for the whole batch: offset each sample's labels into its own block of bins.
+        nbins = max(_num_classes, len(_CLASS_NAMES))
+        offsets = torch.arange(pred.shape[0], device=pred.device).view(-1, 1, 1) * nbins
+        hist = torch.bincount((pred + offsets).view(-1), minlength=pred.shape[0] * nbins)
+        hist = hist.view(-1, nbins).tolist()
+        pred = pred.to(torch.uint8).cpu().numpy()
+    return pred, hist
+
+
+def _pad_batch(t: torch.Tensor) -> torch.Tensor:
+    n = t.shape[0]
+    target = next((b for b in _BATCH_BUCKETS if b >= n), n)
+    if target == n:
+        return t
+    return torch.cat([t, t[-1:].expand(target - n, -1, -1, -1)])
+
+
+async def _batch_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await _batch_queue.get()]
+        deadline = loop.time() + _BATCH_WAIT_S
+        while len(items) < _MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(_batch_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            pre_t = torch.cat([pre for pre, _, _ in items])
+            post_t = torch.cat([post for _, post, _ in items])
+            if _padded_batches:
+                pre_t, post_t = _pad_batch(pre_t), _pad_batch(post_t)
+            preds, hists = await loop.run_in_executor(_inference_executor, _run_inference, pre_t, post_t)
+        except Exception as e:
+            for _, _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+        for pred, hist, (_, _, fut) in zip(preds, hists, items):
+            if not fut.done():
+                fut.set_result((pred, hist))
+
+
+async def _infer_batched(pre_t: torch.Tensor, post_t: torch.Tensor) -> tuple[np.ndarray, list[int]]:
+    fut = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((pre_t, post_t, fut))
+    return await fut
 
 
 def _calculate_damage_score(pred: np.ndarray, counts: dict) -> float:
@@ -127,15 +281,19 @@ def _calculate_damage_score(pred: np.ndarray, counts: dict) -> float:
     return round(damage_score, 2)
 
 
+# JSON parsing accepts NaN/Infinity; reject them before they reach the routing kernels.
+FiniteFloat = confloat(allow_inf_nan=False)
+
+
 class RouteHub(BaseModel):
-    lat: float
-    lng: float
+    lat: FiniteFloat
+    lng: FiniteFloat
 
 
 class RouteSite(BaseModel):
-    lat: float
-    lng: float
-    damage_score: float
+    lat: FiniteFloat
+    lng: FiniteFloat
+    damage_score: FiniteFloat
 
 
 class RouteRequest(BaseModel):
@@ -177,11 +335,13 @@ def compute_route(req: RouteRequest) -> RouteResponse:
             damage_weight=req.damage_weight, algorithm=req.algorithm,
         )
     algo = req.algorithm if req.algorithm in ("greedy", "tsp") else "greedy"
-    hub = (req.hub.lat, req.hub.lng)
-    sites = [(s.lat, s.lng, s.damage_score) for s in req.sites]
-    order, cost_km = route_order(hub, sites, damage_weight=req.damage_weight, algorithm=algo)
-    coords = [hub] + [(s.lat, s.lng) for s in req.sites]
-    dist_km = total_distance_km(order, coords)
+    # Index 0 is the hub; build each column in a single pass straight into float64 arrays.
+    n = len(req.sites) + 1
+    lat = np.fromiter(chain((req.hub.lat,), (s.lat for s in req.sites)), dtype=np.float64, count=n)
+    lng = np.fromiter(chain((req.hub.lng,), (s.lng for s in req.sites)), dtype=np.float64, count=n)
+    damage = np.fromiter(chain((0.0,), (s.damage_score for s in req.sites)), dtype=np.float64, count=n)
+    order, cost_km = route_order(lat, lng, damage, damage_weight=req.damage_weight, algorithm=algo)
+    dist_km = total_distance_km(order, lat, lng)
     return RouteResponse(
         order=order,
         total_distance_km=round(dist_km, 4),
@@ -191,15 +351,21 @@ def compute_route(req: RouteRequest) -> RouteResponse:
     )
 
 
+@lru_cache(maxsize=1)
+def _openai_client(api_key: str) -> AsyncOpenAI:
+    """Shared client so requests reuse one HTTP connection pool."""
+    return AsyncOpenAI(api_key=api_key)
+
+
 @app.post("/summary")
-def generate_summary(req: SummaryRequest) -> dict[str, str]:
+async def generate_summary(req: SummaryRequest) -> dict[str, str]:
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise HTTPException(
             status_code=503,
             detail="OPENAI_API_KEY not set. Set it in your environment to enable summaries.",
         )
-    client = OpenAI(api_key=api_key)
+    client = _openai_client(api_key)
 
     def _fmt_stats(stats: dict) -> str:
         parts = []
@@ -259,7 +425,7 @@ Write a concise 2-4 paragraph summary that:
 Use plain language. Be specific about scores and percentages."""
 
     try:
-        resp = client.chat.completions.create(
+        resp = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=800,
@@ -312,6 +478,10 @@ _SEED_OFFSETS: list[tuple[float, float]] = [
 ]
 
 
+# Seed payloads are static files: encode each region once on first request, then serve from memory.
+_SEED_CACHE: dict[str, dict] = {}
+
+
 def _seed_coords_from_hub(
     hub_lat: float, hub_lng: float, offsets: list[tuple[float, float]]
 ) -> list[tuple[float, float]]:
@@ -351,24 +521,28 @@ def _build_seed_response(
 
 @app.get("/seed/colorado")
 def seed_colorado():
-    data_dir = ROOT / "data" / "EARTHQUAKE-TURKEY" / "images"
-    coords = _seed_coords_from_hub(
-        _COLORADO_HUB_LAT, _COLORADO_HUB_LNG, _SEED_OFFSETS
-    )
-    return _build_seed_response(
-        data_dir, coords, _COLORADO_HUB_LAT, _COLORADO_HUB_LNG, _COLORADO_IMAGE_IDS
-    )
+    if "colorado" not in _SEED_CACHE:
+        data_dir = ROOT / "data" / "EARTHQUAKE-TURKEY" / "images"
+        coords = _seed_coords_from_hub(
+            _COLORADO_HUB_LAT, _COLORADO_HUB_LNG, _SEED_OFFSETS
+        )
+        _SEED_CACHE["colorado"] = _build_seed_response(
+            data_dir, coords, _COLORADO_HUB_LAT, _COLORADO_HUB_LNG, _COLORADO_IMAGE_IDS
+        )
+    return _SEED_CACHE["colorado"]
 
 
 @app.get("/seed/japan")
 def seed_japan():
-    data_dir = ROOT / "data" / "EARTHQUAKE-TURKEY" / "images"
-    coords = _seed_coords_from_hub(
-        _JAPAN_HUB_LAT, _JAPAN_HUB_LNG, _JAPAN_SEED_OFFSETS
-    )
-    return _build_seed_response(
-        data_dir, coords, _JAPAN_HUB_LAT, _JAPAN_HUB_LNG, _JAPAN_IMAGE_IDS
-    )
+    if "japan" not in _SEED_CACHE:
+        data_dir = ROOT / "data" / "EARTHQUAKE-TURKEY" / "images"
+        coords = _seed_coords_from_hub(
+            _JAPAN_HUB_LAT, _JAPAN_HUB_LNG, _JAPAN_SEED_OFFSETS
+        )
+        _SEED_CACHE["japan"] = _build_seed_response(
+            data_dir, coords, _JAPAN_HUB_LAT, _JAPAN_HUB_LNG, _JAPAN_IMAGE_IDS
+        )
+    return _SEED_CACHE["japan"]
 
 
 @app.get("/health")
@@ -376,31 +550,26 @@ def health():
     return {"status": "ok", "model_loaded": _model is not None}
 
 
-@app.post("/predict")
-async def predict(
-    pre_image: UploadFile = File(..., description="Pre-disaster image"),
-    post_image: UploadFile = File(..., description="Post-disaster image"),
-):
-    if _model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    pre_data = await pre_image.read()
-    post_data = await post_image.read()
+def _decode_and_preprocess(pre_data: bytes, post_data: bytes) -> tuple[torch.Tensor, torch.Tensor]:
     pre_img = _decode_image(pre_data)
     post_img = _decode_image(post_data)
-    pre_t, post_t = _preprocess_pair(pre_img, post_img)
-    pred = _run_inference(pre_t, post_t)
+    return _preprocess_pair(pre_img, post_img)
+
+
+def _encode_mask_png(pred: np.ndarray) -> np.ndarray:
     colorized = damage_colored_mask(pred, bgr=True)
-    _, png_bytes = cv2.imencode(".png", colorized)
-    mask_b64 = base64.b64encode(png_bytes.tobytes()).decode("ascii")
-    counts = damage_counts(pred)
+    # Level 1 deflate: the flat few-colour mask compresses nearly as well at a fraction of the CPU cost.
+    _, png_bytes = cv2.imencode(".png", colorized, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    return png_bytes
+
+
+def _prediction_response(pred: np.ndarray, hist: list[int]) -> dict:
+    mask_b64 = base64.b64encode(_encode_mask_png(pred)).decode("ascii")
+    counts = {name: hist[i] for i, name in enumerate(_CLASS_NAMES[1:], 1)}
     total = pred.size
-    class_names = ["background", "no_damage", "minor_damage", "major_damage", "destroyed"]
-    background_px = int((pred == 0).sum())
     stats = {}
-    stats["background"] = {"pixels": background_px, "percent": round(100.0 * background_px / total, 2)}
-    for name in class_names[1:_num_classes]:
-        px = counts.get(name, 0)
-        stats[name] = {"pixels": px, "percent": round(100.0 * px / total, 2)}
+    for i, name in enumerate(_CLASS_NAMES[:_num_classes]):
+        stats[name] = {"pixels": hist[i], "percent": round(100.0 * hist[i] / total, 2)}
     damage_score = _calculate_damage_score(pred, counts)
 
     return {
@@ -410,3 +579,32 @@ async def predict(
         "stats": stats,
         "damage_score": damage_score,
     }
+
+
+async def _predict_pair(pre_image: UploadFile, post_image: UploadFile) -> tuple[np.ndarray, list[int]]:
+    if _model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    pre_data = await pre_image.read()
+    post_data = await post_image.read()
+    pre_t, post_t = await asyncio.to_thread(_decode_and_preprocess, pre_data, post_data)
+    return await _infer_batched(pre_t, post_t)
+
+
+@app.post("/predict")
+async def predict(
+    pre_image: UploadFile = File(..., description="Pre-disaster image"),
+    post_image: UploadFile = File(..., description="Post-disaster image"),
+):
+    pred, hist = await _predict_pair(pre_image, post_image)
+    return await asyncio.to_thread(_prediction_response, pred, hist)
+
+
+@app.post("/predict/mask")
+async def predict_mask(
+    pre_image: UploadFile = File(..., description="Pre-disaster image"),
+    post_image: UploadFile = File(..., description="Post-disaster image"),
+):
+    """Colorized mask as raw PNG bytes, for clients that don't need the JSON stats."""
+    pred, _ = await _predict_pair(pre_image, post_image)
+    png_bytes = await asyncio.to_thread(_encode_mask_png, pred)
+    return Response(content=png_bytes.tobytes(), media_type="image/png")
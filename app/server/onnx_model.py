@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import numpy as np
+import torch
+
+try:
+    import onnxruntime as ort
+    _HAS_ORT = True
+except ImportError:
+    _HAS_ORT = False
+
+
+class OnnxSegmentationModel:
+    """ONNX Runtime session with the DamageSegmentationModel call signature.
+
+    Inputs and output are bound to torch tensors through IO binding, so data stays on the device.
+    Expects a graph exported by scripts/export_onnx.py.
+    """
+
+    def __init__(self, onnx_path: Path, device: torch.device, num_classes: int):
+        if not _HAS_ORT:
+            raise ImportError("onnxruntime (or onnxruntime-gpu) is required for ONNX_MODEL_PATH")
+        if device.type not in ("cuda", "cpu"):
+            raise ValueError(f"ONNX Runtime serving supports cuda and cpu devices, got {device.type}")
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda":
+            providers.insert(0, ("CUDAExecutionProvider", {"device_id": device.index or 0}))
+        self.session = ort.InferenceSession(str(onnx_path), providers=providers)
+        if device.type == "cuda" and "CUDAExecutionProvider" not in self.session.get_providers():
+            # ORT silently falls back to CPU (e.g. CPU-only onnxruntime, CUDA/cuDNN mismatch); CUDA
+            # pointers bound in __call__ would then fail on every request, so refuse to start instead.
+            raise RuntimeError(
+                "ONNX Runtime could not enable CUDAExecutionProvider "
+                f"(active: {self.session.get_providers()}). Install a matching onnxruntime-gpu "
+                "or run the server on CPU."
+            )
+        self.device = device
+        self.num_classes = num_classes
+
+    def __call__(self, pre_image: torch.Tensor, post_image: torch.Tensor) -> torch.Tensor:
+        pre_image = pre_image.float().contiguous()
+        post_image = post_image.float().contiguous()
+        b, _, h, w = pre_image.shape
+        logits = torch.empty((b, self.num_classes, h, w), dtype=torch.float32, device=self.device)
+        device_id = self.device.index or 0
+        binding = self.session.io_binding()
+        for name, t in (("pre_image", pre_image), ("post_image", post_image), ("logits", logits)):
+            bind = binding.bind_output if name == "logits" else binding.bind_input
+            bind(
+                name=name,
+                device_type=self.device.type,
+                device_id=device_id,
+                element_type=np.float32,
+                shape=tuple(t.shape),
+                buffer_ptr=t.data_ptr(),
+            )
+        if self.device.type == "cuda":
+            # ORT runs on its own stream; make sure torch has finished writing the inputs.
+            torch.cuda.current_stream(self.device).synchronize()
+        self.session.run_with_iobinding(binding)
+        binding.synchronize_outputs()
+        return logits
@@ -1,52 +1,102 @@
-import math
 from typing import Literal
 
-def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
-    R = 6371.0
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlam = math.radians(lng2 - lng1)
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+import numpy as np
+
+try:
+    from numba import njit
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _haversine_rad_km(
+    lat1: float, lng1: float, lat2: np.ndarray, lng2: np.ndarray
+) -> np.ndarray:
+    """Great-circle distances (km) from one point to many; all inputs in radians."""
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix_km(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """Pairwise great-circle distances (n x n, km) computed with NumPy broadcasting; inputs in degrees."""
+    lats, lngs = np.radians(lat), np.radians(lng)
+    return _haversine_rad_km(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+
+
+if _HAS_NUMBA:
+
+    @njit(cache=True)
+    def _haversine_nb(lat1, lng1, lat2, lng2):
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(min(max(a, 0.0), 1.0)))
+
+    @njit(cache=True)
+    def _greedy_route_nb(lat_arr, lng_arr, dmg_arr, damage_weight):
+        # The visited mask is scanned in place and distances go into one reused buffer,
+        # so each step is two passes over n with no per-step allocation.
+        n = lat_arr.shape[0]
+        path = np.zeros(n, dtype=np.int64)
+        visited = np.zeros(n, dtype=np.bool_)
+        visited[0] = True
+        d = np.empty(n)
+        total_km = 0.0
+        current = 0
+        for step in range(1, n):
+            d_max = 0.0
+            for j in range(n):
+                if not visited[j]:
+                    d[j] = _haversine_nb(lat_arr[current], lng_arr[current], lat_arr[j], lng_arr[j])
+                    if d[j] > d_max:
+                        d_max = d[j]
+            if d_max == 0.0:
+                d_max = 1.0
+            best_j = -1
+            best_score = -np.inf
+            for j in range(n):
+                if not visited[j]:
+                    score = damage_weight * dmg_arr[j] - (1.0 - damage_weight) * d[j] / d_max
+                    # best_j < 0 seeds with the first candidate so a NaN score can't leave it unset.
+                    if best_j < 0 or score > best_score:
+                        best_score = score
+                        best_j = j
+            visited[best_j] = True
+            total_km += d[best_j]
+            path[step] = best_j
+            current = best_j
+        return path, total_km
 
 
 def _route_order_greedy(
-    coords: list[tuple[float, float]],
-    damage_scores: list[float],
+    lat: np.ndarray,
+    lng: np.ndarray,
+    damage_scores: np.ndarray,
     damage_weight: float,
 ) -> tuple[list[int], float]:
-    n = len(coords)
+    n = len(lat)
     if n <= 1:
         return ([0], 0.0)
-    unvisited = set(range(1, n))
+    lat, lng = np.radians(lat), np.radians(lng)
+    dmg = damage_scores / 100.0
+    if _HAS_NUMBA:
+        path_arr, total_km = _greedy_route_nb(lat, lng, dmg, float(damage_weight))
+        return (path_arr.tolist(), float(total_km))
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[0] = False
     path = [0]
     total_distance_km = 0.0
     current = 0
 
-    while unvisited:
-        lat_c, lng_c = coords[current]
-        dists = [(j, haversine_km(lat_c, lng_c, coords[j][0], coords[j][1])) for j in unvisited]
-        if not dists:
-            break
-        d_max = max(d for _, d in dists) or 1.0
-
-        best_j = None
-        best_score = float("-inf")
-        for j, d in dists:
-            damage_norm = damage_scores[j] / 100.0
-            dist_norm = d / d_max
-            score = damage_weight * damage_norm - (1.0 - damage_weight) * dist_norm
-            if score > best_score:
-                best_score = score
-                best_j = j
-
-        if best_j is None:
-            break
-        j = best_j
-        unvisited.discard(j)
-        d_km = haversine_km(coords[current][0], coords[current][1], coords[j][0], coords[j][1])
-        total_distance_km += d_km
+    for _ in range(n - 1):
+        unv_idx = np.flatnonzero(unvisited)
+        d = _haversine_rad_km(lat[current], lng[current], lat[unv_idx], lng[unv_idx])
+        d_max = d.max() or 1.0
+        score = damage_weight * dmg[unv_idx] - (1.0 - damage_weight) * d / d_max
+        k = int(score.argmax())
+        j = int(unv_idx[k])
+        unvisited[j] = False
+        total_distance_km += float(d[k])
         path.append(j)
         current = j
 
@@ -54,44 +104,40 @@ def _route_order_greedy(
 
 
 def _route_order_tsp(
-    coords: list[tuple[float, float]],
-    damage_scores: list[float],
+    lat: np.ndarray,
+    lng: np.ndarray,
+    damage_scores: np.ndarray,
     damage_weight: float,
 ) -> tuple[list[int], float]:
     try:
         from ortools.constraint_solver import routing_enums_pb2, pywrapcp
     except ImportError:
-        return _route_order_greedy(coords, damage_scores, damage_weight)
+        return _route_order_greedy(lat, lng, damage_scores, damage_weight)
 
-    n = len(coords)
+    n = len(lat)
     if n <= 1:
         return ([0], 0.0)
 
     SCALE = 1000
-    cost_matrix: list[list[int]] = []
-    for i in range(n):
-        row: list[int] = []
-        for j in range(n):
-            if i == j:
-                row.append(0)
-                continue
-            d_km = haversine_km(coords[i][0], coords[i][1], coords[j][0], coords[j][1])
-            damage = damage_scores[j] if j < len(damage_scores) else 0.0
-            cost_km = d_km * (1.0 - damage_weight * damage / 100.0)
-            if j == 0:
-                cost_km = 0.0
-            row.append(int(round(cost_km * SCALE)))
-        cost_matrix.append(row)
+    cost = haversine_matrix_km(lat, lng) * (1.0 - damage_weight * damage_scores[None, :] / 100.0)
+    cost[:, 0] = 0.0
+    np.fill_diagonal(cost, 0.0)
+    cost_int = np.rint(cost * SCALE).astype(np.int64)
 
     manager = pywrapcp.RoutingIndexManager(n, 1, 0)
     routing = pywrapcp.RoutingModel(manager)
 
-    def cost_callback(from_index: int, to_index: int) -> int:
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return cost_matrix[from_node][to_node]
+    if hasattr(routing, "RegisterTransitMatrix"):
+        # Node-indexed matrix evaluated in C++: no Python callback per arc during local search.
+        transit_callback_index = routing.RegisterTransitMatrix(cost_int.tolist())
+    else:
+        cost_flat: list[int] = cost_int.ravel().tolist()
+        index_to_node = manager.IndexToNode
 
-    transit_callback_index = routing.RegisterTransitCallback(cost_callback)
+        def cost_callback(from_index: int, to_index: int) -> int:
+            return cost_flat[index_to_node(from_index) * n + index_to_node(to_index)]
+
+        transit_callback_index = routing.RegisterTransitCallback(cost_callback)
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
@@ -104,7 +150,7 @@ def _route_order_tsp(
 
     assignment = routing.SolveWithParameters(search_parameters)
     if not assignment:
-        return _route_order_greedy(coords, damage_scores, damage_weight)
+        return _route_order_greedy(lat, lng, damage_scores, damage_weight)
 
     order: list[int] = []
     index = routing.Start(0)
@@ -117,40 +163,36 @@ def _route_order_tsp(
     if order and order[-1] == 0 and len(order) > 1:
         order.pop()
 
-    total_distance_km = total_distance_km_along_order(order, coords)
-    return (order, total_distance_km)
+    return (order, total_distance_km(order, lat, lng))
 
 
-def total_distance_km_along_order(order: list[int], coords: list[tuple[float, float]]) -> float:
+def total_distance_km(order: list[int], lat: np.ndarray, lng: np.ndarray) -> float:
     if len(order) <= 1:
         return 0.0
-    total = 0.0
-    for i in range(len(order) - 1):
-        a, b = order[i], order[i + 1]
-        total += haversine_km(coords[a][0], coords[a][1], coords[b][0], coords[b][1])
-    return total
+    idx = np.asarray(order)
+    lats, lngs = np.radians(lat[idx]), np.radians(lng[idx])
+    return float(_haversine_rad_km(lats[:-1], lngs[:-1], lats[1:], lngs[1:]).sum())
 
 
-def total_distance_km(order: list[int], coords: list[tuple[float, float]]) -> float:
-    return total_distance_km_along_order(order, coords)
+def warm_up() -> None:
+    """Compile the Numba routing kernels ahead of the first request (no-op without Numba)."""
+    if _HAS_NUMBA:
+        lat = np.array([0.0, 0.0, 1.0])
+        lng = np.array([0.0, 1.0, 0.0])
+        _route_order_greedy(lat, lng, np.array([0.0, 50.0, 100.0]), 0.5)
 
 
 def route_order(
-    hub: tuple[float, float],
-    sites: list[tuple[float, float, float]],
+    lat: np.ndarray,
+    lng: np.ndarray,
+    damage_scores: np.ndarray,
     damage_weight: float = 1.0,
     algorithm: Literal["greedy", "tsp"] = "greedy",
 ) -> tuple[list[int], float]:
+    """Visit order over float64 lat/lng/damage arrays whose index 0 is the hub (damage 0)."""
     damage_weight = max(0.0, min(1.0, damage_weight))
-    if not sites:
+    if len(lat) <= 1:
         return ([0], 0.0)
-
-    coords: list[tuple[float, float]] = [hub]
-    damage_scores: list[float] = [0.0]
-    for lat, lng, damage in sites:
-        coords.append((lat, lng))
-        damage_scores.append(float(damage))
-
     if algorithm == "tsp":
-        return _route_order_tsp(coords, damage_scores, damage_weight)
-    return _route_order_greedy(coords, damage_scores, damage_weight)
+        return _route_order_tsp(lat, lng, damage_scores, damage_weight)
+    return _route_order_greedy(lat, lng, damage_scores, damage_weight)
@@ -18,8 +18,10 @@ def get_device(override: str | None = None) -> torch.device:
     return torch.device("cpu")
 
 
-def load_model(checkpoint_path: Path, device: torch.device) -> tuple[DamageSegmentationModel, dict]: 
-    ckpt = torch.load(checkpoint_path, map_location=device)
+def load_model(
+    checkpoint_path: Path, device: torch.device, normalize_input: bool = False
+) -> tuple[DamageSegmentationModel, dict]:
+    ckpt = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
     encoder = ckpt.get("encoder", "resnet34")
     size = ckpt.get("size", 256)
     num_classes = ckpt.get("num_classes", 5)
@@ -29,9 +31,10 @@ def load_model(checkpoint_path: Path, device: torch.device) -> tuple[DamageSegme
         encoder_weights=None,
         in_channels=6,
         num_classes=num_classes,
+        normalize_input=normalize_input,
     )
     state = ckpt["model_state_dict"] if isinstance(ckpt, dict) and "model_state_dict" in ckpt else ckpt
-    model.load_state_dict(state)
+    model.load_state_dict(state, assign=True)
     model.to(device)
     model.eval()
 
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pathlib import Path
 
 import cv2
@@ -71,8 +72,9 @@ def get_segmentation_train_transforms(size: int = 256):
     )
 
 
+@lru_cache(maxsize=None)
 def get_segmentation_eval_transforms(size: int = 256):
-    """No augmentation; resize and normalize for validation/inference."""
+    """No augmentation; resize and normalize for validation/inference. Deterministic, so cached per size."""
     if not _HAS_ALBUMENTATIONS:
         raise ImportError("albumentations is required for DamageSegmentationDataset")
     return A.Compose(
@@ -7,6 +7,9 @@ try:
 except ImportError:
     _HAS_SMP = False
 
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
 
 class DamageSegmentationModel(nn.Module):
     def __init__(
@@ -15,6 +18,7 @@ class DamageSegmentationModel(nn.Module):
         encoder_weights: str | None = "imagenet",
         in_channels: int = 6,
         num_classes: int = 5,
+        normalize_input: bool = False,
     ):
         super().__init__()
         if not _HAS_SMP:
@@ -26,7 +30,18 @@ class DamageSegmentationModel(nn.Module):
             classes=num_classes,
         )
         self.num_classes = num_classes
+        # When set, forward takes [0, 1] RGB pairs and applies ImageNet normalization on-device.
+        # Buffers are non-persistent so checkpoints stay interchangeable with normalize_input=False.
+        self.normalize_input = normalize_input
+        if normalize_input:
+            pairs = in_channels // 3
+            mean = torch.tensor(IMAGENET_MEAN * pairs).view(1, in_channels, 1, 1)
+            std = torch.tensor(IMAGENET_STD * pairs).view(1, in_channels, 1, 1)
+            self.register_buffer("input_mean", mean, persistent=False)
+            self.register_buffer("input_std", std, persistent=False)
 
     def forward(self, pre_image: torch.Tensor, post_image: torch.Tensor) -> torch.Tensor:
         x = torch.cat([pre_image, post_image], dim=1)
+        if self.normalize_input:
+            x = (x.to(self.input_mean.dtype) - self.input_mean) / self.input_std
         return self.model(x)
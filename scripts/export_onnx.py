@@ -0,0 +1,44 @@
+import argparse
+import sys
+from pathlib import Path
+
+# Allow imports from repo root when run as script
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+import torch
+
+from model.common import load_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the damage segmentation model to ONNX for the API server")
+    parser.add_argument("--checkpoint", type=Path, default=Path("checkpoints/best.pt"))
+    parser.add_argument("--output", type=Path, default=None, help="Output path (default: checkpoint with .onnx suffix)")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    # Same input convention as the server: [0, 1] RGB pairs, ImageNet normalization inside the graph.
+    model, config = load_model(args.checkpoint, device, normalize_input=True)
+    size = config["size"]
+    dummy = torch.rand(1, 3, size, size)
+    out_path = args.output or args.checkpoint.with_suffix(".onnx")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Spatial dims are fixed to the training size; only batch is dynamic so the server can micro-batch.
+    torch.onnx.export(
+        model,
+        (dummy, dummy),
+        str(out_path),
+        input_names=["pre_image", "post_image"],
+        output_names=["logits"],
+        dynamic_axes={"pre_image": {0: "batch"}, "post_image": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=args.opset,
+    )
+    print(f"Exported {args.checkpoint} (size={size}, num_classes={config['num_classes']}) to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
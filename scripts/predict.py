@@ -36,7 +36,7 @@ def preprocess_pair(pre_path: Path, post_path: Path, size: int = 256) -> tuple[t
 def run_one(model, pre_t: torch.Tensor, post_t: torch.Tensor, device: torch.device) -> np.ndarray:
     with torch.no_grad():
         logits = model(pre_t.to(device), post_t.to(device))
-        return logits.argmax(dim=1).squeeze(0).cpu().numpy().astype(np.uint8)
+        return logits.argmax(dim=1).squeeze(0).to(torch.uint8).cpu().numpy()
 
 
 def main():